@@ -0,0 +1,175 @@
+-- Помесячное партиционирование analytics_events
+
+-- Функция создания партиции за месяц. Строки, уже попавшие в партицию
+-- по умолчанию за этот месяц, копируются в отдельную таблицу, которая затем
+-- подключается через ATTACH PARTITION. Повторного INSERT в analytics_events
+-- нет, поэтому триггеры на вставку для перенесенных строк не срабатывают.
+-- Границы месяца считаются в UTC независимо от TimeZone сессии.
+-- RLS родительской таблицы на партиции не распространяется, поэтому
+-- на каждой партиции RLS включается без политик: прямой доступ к ней
+-- закрыт, а чтение идет через analytics_events с ее политиками.
+CREATE OR REPLACE FUNCTION create_analytics_events_partition(p_month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    v_start TIMESTAMP WITH TIME ZONE := date_trunc('month', p_month::TIMESTAMP) AT TIME ZONE 'UTC';
+    v_end TIMESTAMP WITH TIME ZONE :=
+        (date_trunc('month', p_month::TIMESTAMP) + INTERVAL '1 month') AT TIME ZONE 'UTC';
+    v_name TEXT := 'analytics_events_' || to_char(p_month, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    -- Блокировка не дает вставить в партицию по умолчанию строку за этот
+    -- месяц, пока строки переносятся и партиция подключается.
+    LOCK TABLE analytics_events_default IN SHARE ROW EXCLUSIVE MODE;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE analytics_events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        v_name
+    );
+    EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', v_name);
+    EXECUTE format(
+        'WITH moved AS (
+             DELETE FROM analytics_events_default
+             WHERE timestamp >= %L AND timestamp < %L
+             RETURNING *
+         )
+         INSERT INTO %I SELECT * FROM moved',
+        v_start, v_end, v_name
+    );
+
+    EXECUTE format(
+        'ALTER TABLE analytics_events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_start, v_end
+    );
+
+    RETURN v_name;
+END;
+$$ language 'plpgsql';
+
+-- Создание партиций на текущий и несколько следующих месяцев
+CREATE OR REPLACE FUNCTION ensure_analytics_events_partitions(p_months_ahead INTEGER DEFAULT 3)
+RETURNS VOID AS $$
+DECLARE
+    v_month DATE;
+BEGIN
+    FOR v_month IN
+        SELECT generate_series(
+            date_trunc('month', NOW() AT TIME ZONE 'UTC'),
+            date_trunc('month', NOW() AT TIME ZONE 'UTC') + make_interval(months => p_months_ahead),
+            INTERVAL '1 month'
+        )::DATE
+    LOOP
+        PERFORM create_analytics_events_partition(v_month);
+    END LOOP;
+END;
+$$ language 'plpgsql';
+
+-- Удаление партиций старше срока хранения (DROP вместо построчного DELETE)
+CREATE OR REPLACE FUNCTION drop_old_analytics_events_partitions(p_retention_months INTEGER DEFAULT 12)
+RETURNS INTEGER AS $$
+DECLARE
+    v_cutoff DATE := date_trunc('month', NOW() AT TIME ZONE 'UTC') - make_interval(months => p_retention_months);
+    v_partition RECORD;
+    v_dropped INTEGER := 0;
+BEGIN
+    FOR v_partition IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'analytics_events'::regclass
+          AND c.relname ~ '^analytics_events_y[0-9]{4}m[0-9]{2}$'
+    LOOP
+        IF to_date(substring(v_partition.relname FROM 'y([0-9]{4}m[0-9]{2})$'), 'YYYY"m"MM') < v_cutoff THEN
+            EXECUTE format('DROP TABLE %I', v_partition.relname);
+            v_dropped := v_dropped + 1;
+        END IF;
+    END LOOP;
+
+    DELETE FROM analytics_events_default
+        WHERE timestamp < v_cutoff::TIMESTAMP AT TIME ZONE 'UTC';
+
+    RETURN v_dropped;
+END;
+$$ language 'plpgsql';
+
+-- Перенос существующей таблицы
+ALTER TABLE analytics_events RENAME TO analytics_events_unpartitioned;
+
+-- timestamp входит в ключ партиционирования и поэтому NOT NULL:
+-- явно переданный NULL теперь отклоняется, а не заменяется на NOW().
+-- Клиенты должны опускать поле, чтобы получить значение по умолчанию.
+CREATE TABLE analytics_events (
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    event_type TEXT NOT NULL,
+    data JSONB NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE analytics_events_default PARTITION OF analytics_events DEFAULT;
+ALTER TABLE analytics_events_default ENABLE ROW LEVEL SECURITY;
+
+-- Партиции для уже накопленных данных и на ближайшие месяцы
+DO $$
+DECLARE
+    v_month DATE;
+BEGIN
+    FOR v_month IN
+        SELECT generate_series(
+            (SELECT date_trunc('month', MIN(timestamp) AT TIME ZONE 'UTC')
+             FROM analytics_events_unpartitioned),
+            date_trunc('month', NOW() AT TIME ZONE 'UTC'),
+            INTERVAL '1 month'
+        )::DATE
+    LOOP
+        PERFORM create_analytics_events_partition(v_month);
+    END LOOP;
+END;
+$$;
+
+SELECT ensure_analytics_events_partitions();
+
+INSERT INTO analytics_events (id, user_id, session_id, event_type, data, timestamp)
+SELECT id, user_id, session_id, event_type, data, COALESCE(timestamp, NOW())
+FROM analytics_events_unpartitioned;
+
+DROP TABLE analytics_events_unpartitioned;
+
+-- Индексы под GET /api/analytics/{user_id}?event_type=...
+CREATE INDEX idx_analytics_events_user_type_timestamp
+    ON analytics_events(user_id, event_type, timestamp DESC);
+CREATE INDEX idx_analytics_events_timestamp_brin
+    ON analytics_events USING BRIN (timestamp);
+
+-- RLS
+ALTER TABLE analytics_events ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own analytics"
+    ON analytics_events FOR SELECT
+    USING (auth.uid()::text = user_id);
+
+CREATE POLICY "Users can create own analytics"
+    ON analytics_events FOR INSERT
+    WITH CHECK (auth.uid()::text = user_id);
+
+-- Ежедневное обслуживание партиций, если доступен pg_cron.
+-- Без pg_cron функции нужно вызывать внешним планировщиком, иначе через
+-- несколько месяцев все новые строки попадут в партицию по умолчанию.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule(
+            'analytics-events-partitions',
+            '0 3 * * *',
+            'SELECT ensure_analytics_events_partitions(); SELECT drop_old_analytics_events_partitions();'
+        );
+    ELSE
+        RAISE WARNING 'pg_cron is not installed: schedule % and % to run daily',
+            'ensure_analytics_events_partitions()', 'drop_old_analytics_events_partitions()';
+    END IF;
+END;
+$$;
@@ -0,0 +1,195 @@
+-- Почасовые и дневные агрегаты активности пользователей
+-- Бакеты считаются в UTC. Перерывы учитываются по событиям
+-- analytics_events с типами 'break_taken' и 'break_skipped'. Сейчас такие
+-- события никто не пишет, поэтому break_adherence остается NULL, пока
+-- клиенты не начнут их отправлять.
+-- Строки, которые create_analytics_events_partition (00002) переносит из
+-- партиции по умолчанию, подключаются через ATTACH PARTITION и повторно
+-- триггер вставки не вызывают.
+
+CREATE TABLE user_activity_hourly (
+    user_id TEXT NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    session_count INTEGER NOT NULL DEFAULT 0,
+    completed_sessions INTEGER NOT NULL DEFAULT 0,
+    focus_minutes NUMERIC NOT NULL DEFAULT 0,
+    breaks_taken INTEGER NOT NULL DEFAULT 0,
+    breaks_skipped INTEGER NOT NULL DEFAULT 0,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    completion_rate NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN session_count > 0 THEN completed_sessions::NUMERIC / session_count END
+    ) STORED,
+    break_adherence NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN breaks_taken + breaks_skipped > 0
+            THEN breaks_taken::NUMERIC / (breaks_taken + breaks_skipped) END
+    ) STORED,
+    PRIMARY KEY (user_id, bucket)
+);
+
+CREATE TABLE user_activity_daily (
+    user_id TEXT NOT NULL,
+    bucket DATE NOT NULL,
+    session_count INTEGER NOT NULL DEFAULT 0,
+    completed_sessions INTEGER NOT NULL DEFAULT 0,
+    focus_minutes NUMERIC NOT NULL DEFAULT 0,
+    breaks_taken INTEGER NOT NULL DEFAULT 0,
+    breaks_skipped INTEGER NOT NULL DEFAULT 0,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    completion_rate NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN session_count > 0 THEN completed_sessions::NUMERIC / session_count END
+    ) STORED,
+    break_adherence NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN breaks_taken + breaks_skipped > 0
+            THEN breaks_taken::NUMERIC / (breaks_taken + breaks_skipped) END
+    ) STORED,
+    PRIMARY KEY (user_id, bucket)
+);
+
+-- Инкремент обоих агрегатов
+CREATE OR REPLACE FUNCTION bump_user_activity(
+    p_user_id TEXT,
+    p_ts TIMESTAMP WITH TIME ZONE,
+    p_sessions INTEGER DEFAULT 0,
+    p_completed INTEGER DEFAULT 0,
+    p_focus_minutes NUMERIC DEFAULT 0,
+    p_breaks_taken INTEGER DEFAULT 0,
+    p_breaks_skipped INTEGER DEFAULT 0,
+    p_events INTEGER DEFAULT 0
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO user_activity_hourly AS r (
+        user_id, bucket, session_count, completed_sessions, focus_minutes,
+        breaks_taken, breaks_skipped, event_count
+    )
+    VALUES (
+        p_user_id, date_trunc('hour', p_ts AT TIME ZONE 'UTC'), p_sessions, p_completed,
+        p_focus_minutes, p_breaks_taken, p_breaks_skipped, p_events
+    )
+    ON CONFLICT (user_id, bucket) DO UPDATE SET
+        session_count = r.session_count + EXCLUDED.session_count,
+        completed_sessions = r.completed_sessions + EXCLUDED.completed_sessions,
+        focus_minutes = r.focus_minutes + EXCLUDED.focus_minutes,
+        breaks_taken = r.breaks_taken + EXCLUDED.breaks_taken,
+        breaks_skipped = r.breaks_skipped + EXCLUDED.breaks_skipped,
+        event_count = r.event_count + EXCLUDED.event_count;
+
+    INSERT INTO user_activity_daily AS r (
+        user_id, bucket, session_count, completed_sessions, focus_minutes,
+        breaks_taken, breaks_skipped, event_count
+    )
+    VALUES (
+        p_user_id, (p_ts AT TIME ZONE 'UTC')::DATE, p_sessions, p_completed,
+        p_focus_minutes, p_breaks_taken, p_breaks_skipped, p_events
+    )
+    ON CONFLICT (user_id, bucket) DO UPDATE SET
+        session_count = r.session_count + EXCLUDED.session_count,
+        completed_sessions = r.completed_sessions + EXCLUDED.completed_sessions,
+        focus_minutes = r.focus_minutes + EXCLUDED.focus_minutes,
+        breaks_taken = r.breaks_taken + EXCLUDED.breaks_taken,
+        breaks_skipped = r.breaks_skipped + EXCLUDED.breaks_skipped,
+        event_count = r.event_count + EXCLUDED.event_count;
+END;
+$$ language 'plpgsql';
+
+-- Триггер на новые события аналитики
+CREATE OR REPLACE FUNCTION rollup_analytics_event()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_user_activity(
+        NEW.user_id,
+        NEW.timestamp,
+        p_breaks_taken => (NEW.event_type = 'break_taken')::INTEGER,
+        p_breaks_skipped => (NEW.event_type = 'break_skipped')::INTEGER,
+        p_events => 1
+    );
+    RETURN NULL;
+END;
+$$ language 'plpgsql' SECURITY DEFINER SET search_path = public;
+
+-- Вклад завершенной сессии в фокус-время (в минутах)
+CREATE OR REPLACE FUNCTION learning_session_focus_minutes(p_session learning_sessions)
+RETURNS NUMERIC AS $$
+    SELECT (COALESCE(
+        p_session.duration,
+        EXTRACT(EPOCH FROM p_session.ended_at - p_session.created_at),
+        0
+    ) / 60.0)::NUMERIC;
+$$ language 'sql' IMMUTABLE;
+
+-- Триггер на изменение учебной сессии: вычитается вклад старой версии
+-- строки и добавляется вклад новой. Учитываются только сессии с ended_at;
+-- бакет определяется по created_at, а если его нет, по ended_at.
+CREATE OR REPLACE FUNCTION rollup_learning_session()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF OLD.ended_at IS NOT NULL THEN
+            PERFORM bump_user_activity(
+                OLD.user_id,
+                COALESCE(OLD.created_at, OLD.ended_at),
+                p_sessions => -1,
+                p_completed => -COALESCE(OLD.status = 'completed', FALSE)::INTEGER,
+                p_focus_minutes => -learning_session_focus_minutes(OLD)
+            );
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NEW.ended_at IS NOT NULL THEN
+            PERFORM bump_user_activity(
+                NEW.user_id,
+                COALESCE(NEW.created_at, NEW.ended_at),
+                p_sessions => 1,
+                p_completed => COALESCE(NEW.status = 'completed', FALSE)::INTEGER,
+                p_focus_minutes => learning_session_focus_minutes(NEW)
+            );
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql' SECURITY DEFINER SET search_path = public;
+
+CREATE TRIGGER rollup_analytics_events
+    AFTER INSERT ON analytics_events
+    FOR EACH ROW
+    EXECUTE FUNCTION rollup_analytics_event();
+
+CREATE TRIGGER rollup_learning_sessions
+    AFTER INSERT OR DELETE
+        OR UPDATE OF user_id, created_at, ended_at, status, duration
+    ON learning_sessions
+    FOR EACH ROW
+    EXECUTE FUNCTION rollup_learning_session();
+
+-- Заполнение агрегатов по уже накопленным данным
+SELECT bump_user_activity(
+    user_id,
+    timestamp,
+    p_breaks_taken => (event_type = 'break_taken')::INTEGER,
+    p_breaks_skipped => (event_type = 'break_skipped')::INTEGER,
+    p_events => 1
+)
+FROM analytics_events;
+
+SELECT bump_user_activity(
+    user_id,
+    COALESCE(created_at, ended_at),
+    p_sessions => 1,
+    p_completed => COALESCE(status = 'completed', FALSE)::INTEGER,
+    p_focus_minutes => learning_session_focus_minutes(s)
+)
+FROM learning_sessions s
+WHERE ended_at IS NOT NULL;
+
+-- RLS
+ALTER TABLE user_activity_hourly ENABLE ROW LEVEL SECURITY;
+ALTER TABLE user_activity_daily ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own hourly activity"
+    ON user_activity_hourly FOR SELECT
+    USING (auth.uid()::text = user_id);
+
+CREATE POLICY "Users can view own daily activity"
+    ON user_activity_daily FOR SELECT
+    USING (auth.uid()::text = user_id);
@@ -0,0 +1,174 @@
+-- Вынос learning_history из JSONB профиля в отдельную append-only таблицу.
+-- В user_profiles.learning_history остаются только последние записи.
+-- Новые записи следует добавлять через append_learning_history. Если клиент
+-- по-прежнему дописывает элементы в user_profiles.learning_history, триггер
+-- переносит их в таблицу learning_history, и сводка остается ограниченной.
+
+CREATE TABLE learning_history (
+    id BIGINT GENERATED ALWAYS AS IDENTITY,
+    user_id TEXT NOT NULL,
+    ts TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    entry JSONB NOT NULL,
+    PRIMARY KEY (user_id, ts, id)
+);
+
+-- updated_at отражает изменения настроек, а не обновление сводки истории.
+-- Заменяется до переноса данных, чтобы миграция не трогала updated_at.
+DROP TRIGGER update_user_profiles_updated_at ON user_profiles;
+
+CREATE TRIGGER update_user_profiles_updated_at
+    BEFORE UPDATE ON user_profiles
+    FOR EACH ROW
+    WHEN (OLD.preferences IS DISTINCT FROM NEW.preferences)
+    EXECUTE FUNCTION update_updated_at_column();
+
+-- Перенос накопленной истории. Порядок записей сохраняется,
+-- время отсчитывается назад от последнего обновления профиля.
+INSERT INTO learning_history (user_id, ts, entry)
+SELECT
+    p.user_id,
+    COALESCE(p.updated_at, p.created_at, NOW())
+        - (jsonb_array_length(p.learning_history) - h.position) * INTERVAL '1 microsecond',
+    h.entry
+FROM user_profiles p
+CROSS JOIN LATERAL jsonb_array_elements(p.learning_history) WITH ORDINALITY AS h(entry, position)
+WHERE jsonb_typeof(p.learning_history) = 'array'
+ORDER BY p.user_id, h.position;
+
+-- Последние записи истории пользователя для сводки в профиле
+CREATE OR REPLACE FUNCTION recent_learning_history(p_user_id TEXT, p_limit INTEGER DEFAULT 10)
+RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_agg(recent.entry ORDER BY recent.ts, recent.id), '[]'::jsonb)
+    FROM (
+        SELECT entry, ts, id
+        FROM learning_history
+        WHERE user_id = p_user_id
+        ORDER BY ts DESC, id DESC
+        LIMIT p_limit
+    ) recent;
+$$ language 'sql' STABLE;
+
+-- Обновление сводки в профиле. Флаг adhd.learning_history_sync отличает
+-- это обновление от записей клиентов для триггера divert_learning_history.
+CREATE OR REPLACE FUNCTION refresh_recent_learning_history(p_user_id TEXT)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM set_config('adhd.learning_history_sync', 'on', true);
+    UPDATE user_profiles
+    SET learning_history = recent_learning_history(p_user_id)
+    WHERE user_id = p_user_id;
+    PERFORM set_config('adhd.learning_history_sync', 'off', true);
+END;
+$$ language 'plpgsql';
+
+-- Сводка обновляется один раз на пользователя за оператор INSERT,
+-- а не на каждую добавленную запись.
+CREATE OR REPLACE FUNCTION sync_recent_learning_history()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_user_id TEXT;
+BEGIN
+    IF current_setting('adhd.learning_history_sync', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    FOR v_user_id IN SELECT DISTINCT user_id FROM new_entries LOOP
+        PERFORM refresh_recent_learning_history(v_user_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ language 'plpgsql' SECURITY DEFINER SET search_path = public;
+
+CREATE TRIGGER sync_recent_learning_history
+    AFTER INSERT ON learning_history
+    REFERENCING NEW TABLE AS new_entries
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION sync_recent_learning_history();
+
+-- Элементы, которые клиент записал в user_profiles.learning_history и
+-- которых еще нет в learning_history (сравнение по содержимому записи),
+-- переносятся в таблицу. Так клиент со старой полной копией массива не
+-- дублирует уже перенесенную историю. История только дополняется, поэтому
+-- сокращение или замена массива игнорируются.
+CREATE OR REPLACE FUNCTION divert_learning_history()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_added INTEGER;
+BEGIN
+    IF current_setting('adhd.learning_history_sync', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+
+    v_added := 0;
+    IF jsonb_typeof(NEW.learning_history) = 'array' THEN
+        PERFORM set_config('adhd.learning_history_sync', 'on', true);
+        INSERT INTO learning_history (user_id, entry)
+        SELECT NEW.user_id, h.entry
+        FROM jsonb_array_elements(NEW.learning_history) WITH ORDINALITY AS h(entry, position)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM learning_history l
+            WHERE l.user_id = NEW.user_id AND l.entry = h.entry
+        )
+        ORDER BY h.position;
+        GET DIAGNOSTICS v_added = ROW_COUNT;
+        PERFORM set_config('adhd.learning_history_sync', 'off', true);
+    END IF;
+
+    IF v_added > 0 THEN
+        NEW.learning_history := recent_learning_history(NEW.user_id);
+    ELSE
+        NEW.learning_history := OLD.learning_history;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ language 'plpgsql' SECURITY DEFINER SET search_path = public;
+
+CREATE TRIGGER divert_learning_history
+    BEFORE UPDATE OF learning_history ON user_profiles
+    FOR EACH ROW
+    EXECUTE FUNCTION divert_learning_history();
+
+DO $$
+DECLARE
+    v_user_id TEXT;
+BEGIN
+    FOR v_user_id IN SELECT user_id FROM user_profiles LOOP
+        PERFORM refresh_recent_learning_history(v_user_id);
+    END LOOP;
+END;
+$$;
+
+-- Добавление записи в историю
+CREATE OR REPLACE FUNCTION append_learning_history(p_user_id TEXT, p_entry JSONB)
+RETURNS learning_history AS $$
+    INSERT INTO learning_history (user_id, entry)
+    VALUES (p_user_id, p_entry)
+    RETURNING *;
+$$ language 'sql';
+
+-- Постраничное чтение истории (keyset: курсор по последней полученной записи)
+CREATE OR REPLACE FUNCTION get_learning_history(
+    p_user_id TEXT,
+    p_before_ts TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_before_id BIGINT DEFAULT NULL,
+    p_limit INTEGER DEFAULT 50
+)
+RETURNS SETOF learning_history AS $$
+    SELECT *
+    FROM learning_history
+    WHERE user_id = p_user_id
+      AND (p_before_ts IS NULL OR (ts, id) < (p_before_ts, p_before_id))
+    ORDER BY ts DESC, id DESC
+    LIMIT p_limit;
+$$ language 'sql' STABLE;
+
+-- RLS
+ALTER TABLE learning_history ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own learning history"
+    ON learning_history FOR SELECT
+    USING (auth.uid()::text = user_id);
+
+CREATE POLICY "Users can create own learning history"
+    ON learning_history FOR INSERT
+    WITH CHECK (auth.uid()::text = user_id);
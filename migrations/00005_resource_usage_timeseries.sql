@@ -0,0 +1,243 @@
+-- Типизированное хранение метрик ресурсов с прореживанием:
+-- сырые снимки -> минутные агрегаты -> часовые агрегаты.
+-- Старая таблица resource_usage (JSONB) остается для истории.
+
+CREATE TABLE resource_usage_raw (
+    node TEXT NOT NULL DEFAULT 'default',
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    cpu_usage REAL,
+    gpu_usage REAL,
+    memory_usage REAL,
+    storage_usage REAL,
+    api_calls INTEGER,
+    queue_size INTEGER,
+    active_sessions INTEGER,
+    PRIMARY KEY (node, timestamp)
+);
+
+CREATE TABLE resource_usage_1m (
+    node TEXT NOT NULL,
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    samples INTEGER NOT NULL,
+    cpu_samples INTEGER NOT NULL,
+    gpu_samples INTEGER NOT NULL,
+    memory_samples INTEGER NOT NULL,
+    cpu_avg REAL,
+    cpu_max REAL,
+    gpu_avg REAL,
+    gpu_max REAL,
+    memory_avg REAL,
+    memory_max REAL,
+    storage_max REAL,
+    api_calls_max INTEGER,
+    queue_size_max INTEGER,
+    active_sessions_max INTEGER,
+    PRIMARY KEY (node, bucket)
+);
+
+CREATE TABLE resource_usage_1h (LIKE resource_usage_1m INCLUDING ALL);
+
+CREATE INDEX idx_resource_usage_raw_timestamp_brin
+    ON resource_usage_raw USING BRIN (timestamp);
+CREATE INDEX idx_resource_usage_1m_bucket ON resource_usage_1m(bucket);
+CREATE INDEX idx_resource_usage_1h_bucket ON resource_usage_1h(bucket);
+
+-- Пакетная запись снимков одним запросом.
+-- p_samples: JSON-массив объектов с полями таблицы resource_usage_raw.
+-- timestamp обязателен: снимки без него получили бы одинаковое NOW()
+-- и были бы отброшены как дубликаты по (node, timestamp).
+CREATE OR REPLACE FUNCTION record_resource_usage(p_samples JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_inserted INTEGER;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM jsonb_to_recordset(p_samples) AS s(timestamp TIMESTAMP WITH TIME ZONE)
+        WHERE s.timestamp IS NULL
+    ) THEN
+        RAISE EXCEPTION 'record_resource_usage: every sample must have a timestamp';
+    END IF;
+
+    INSERT INTO resource_usage_raw (
+        node, timestamp, cpu_usage, gpu_usage, memory_usage, storage_usage,
+        api_calls, queue_size, active_sessions
+    )
+    SELECT
+        COALESCE(s.node, 'default'), s.timestamp,
+        s.cpu_usage, s.gpu_usage, s.memory_usage, s.storage_usage,
+        s.api_calls, s.queue_size, s.active_sessions
+    FROM jsonb_to_recordset(p_samples) AS s(
+        node TEXT,
+        timestamp TIMESTAMP WITH TIME ZONE,
+        cpu_usage REAL,
+        gpu_usage REAL,
+        memory_usage REAL,
+        storage_usage REAL,
+        api_calls INTEGER,
+        queue_size INTEGER,
+        active_sessions INTEGER
+    )
+    ON CONFLICT (node, timestamp) DO NOTHING;
+
+    GET DIAGNOSTICS v_inserted = ROW_COUNT;
+    RETURN v_inserted;
+END;
+$$ language 'plpgsql';
+
+-- Агрегация завершенных интервалов и удаление устаревших данных.
+-- Интервалы за последние p_late_window пересчитываются при каждом запуске,
+-- поэтому опоздавшие снимки любого узла попадают в агрегаты. Более старые
+-- интервалы агрегируются после водяного знака узла (последнего уже
+-- посчитанного бакета) - это догон после простоя. Нижняя граница чтения
+-- общая для всех узлов, поэтому сканируется только свежая часть таблиц.
+-- Снимки, пришедшие позже p_late_window, не учитываются.
+CREATE OR REPLACE FUNCTION downsample_resource_usage(
+    p_late_window INTERVAL DEFAULT INTERVAL '15 minutes',
+    p_raw_retention INTERVAL DEFAULT INTERVAL '1 day',
+    p_minute_retention INTERVAL DEFAULT INTERVAL '7 days',
+    p_hour_retention INTERVAL DEFAULT INTERVAL '1 year'
+)
+RETURNS VOID AS $$
+DECLARE
+    v_minute_end TIMESTAMP WITH TIME ZONE := date_trunc('minute', NOW());
+    v_hour_end TIMESTAMP WITH TIME ZONE := date_trunc('hour', NOW());
+    v_minute_window TIMESTAMP WITH TIME ZONE := date_trunc('minute', NOW() - p_late_window);
+    v_hour_window TIMESTAMP WITH TIME ZONE := date_trunc('hour', NOW() - p_late_window);
+    v_minute_from TIMESTAMP WITH TIME ZONE;
+    v_hour_from TIMESTAMP WITH TIME ZONE;
+BEGIN
+    CREATE TEMP TABLE resource_usage_minute_marks ON COMMIT DROP AS
+        SELECT node, MAX(bucket) + INTERVAL '1 minute' AS next_bucket
+        FROM resource_usage_1m
+        WHERE bucket >= NOW() - p_raw_retention
+        GROUP BY node;
+
+    SELECT LEAST(v_minute_window, COALESCE(MIN(next_bucket), '-infinity'))
+    INTO v_minute_from
+    FROM resource_usage_minute_marks;
+
+    INSERT INTO resource_usage_1m
+    SELECT
+        r.node,
+        date_trunc('minute', r.timestamp),
+        COUNT(*),
+        COUNT(r.cpu_usage),
+        COUNT(r.gpu_usage),
+        COUNT(r.memory_usage),
+        AVG(r.cpu_usage), MAX(r.cpu_usage),
+        AVG(r.gpu_usage), MAX(r.gpu_usage),
+        AVG(r.memory_usage), MAX(r.memory_usage),
+        MAX(r.storage_usage),
+        MAX(r.api_calls),
+        MAX(r.queue_size),
+        MAX(r.active_sessions)
+    FROM resource_usage_raw r
+    LEFT JOIN resource_usage_minute_marks w ON w.node = r.node
+    WHERE r.timestamp >= v_minute_from
+      AND r.timestamp < v_minute_end
+      AND (r.timestamp >= v_minute_window OR w.next_bucket IS NULL OR r.timestamp >= w.next_bucket)
+    GROUP BY r.node, date_trunc('minute', r.timestamp)
+    ON CONFLICT (node, bucket) DO UPDATE SET
+        samples = EXCLUDED.samples,
+        cpu_samples = EXCLUDED.cpu_samples,
+        gpu_samples = EXCLUDED.gpu_samples,
+        memory_samples = EXCLUDED.memory_samples,
+        cpu_avg = EXCLUDED.cpu_avg,
+        cpu_max = EXCLUDED.cpu_max,
+        gpu_avg = EXCLUDED.gpu_avg,
+        gpu_max = EXCLUDED.gpu_max,
+        memory_avg = EXCLUDED.memory_avg,
+        memory_max = EXCLUDED.memory_max,
+        storage_max = EXCLUDED.storage_max,
+        api_calls_max = EXCLUDED.api_calls_max,
+        queue_size_max = EXCLUDED.queue_size_max,
+        active_sessions_max = EXCLUDED.active_sessions_max;
+
+    CREATE TEMP TABLE resource_usage_hour_marks ON COMMIT DROP AS
+        SELECT node, MAX(bucket) + INTERVAL '1 hour' AS next_bucket
+        FROM resource_usage_1h
+        WHERE bucket >= NOW() - p_minute_retention
+        GROUP BY node;
+
+    SELECT LEAST(v_hour_window, COALESCE(MIN(next_bucket), '-infinity'))
+    INTO v_hour_from
+    FROM resource_usage_hour_marks;
+
+    INSERT INTO resource_usage_1h
+    SELECT
+        m.node,
+        date_trunc('hour', m.bucket),
+        SUM(m.samples),
+        SUM(m.cpu_samples),
+        SUM(m.gpu_samples),
+        SUM(m.memory_samples),
+        SUM(m.cpu_avg * m.cpu_samples) / NULLIF(SUM(m.cpu_samples), 0), MAX(m.cpu_max),
+        SUM(m.gpu_avg * m.gpu_samples) / NULLIF(SUM(m.gpu_samples), 0), MAX(m.gpu_max),
+        SUM(m.memory_avg * m.memory_samples) / NULLIF(SUM(m.memory_samples), 0), MAX(m.memory_max),
+        MAX(m.storage_max),
+        MAX(m.api_calls_max),
+        MAX(m.queue_size_max),
+        MAX(m.active_sessions_max)
+    FROM resource_usage_1m m
+    LEFT JOIN resource_usage_hour_marks w ON w.node = m.node
+    WHERE m.bucket >= v_hour_from
+      AND m.bucket < v_hour_end
+      AND (m.bucket >= v_hour_window OR w.next_bucket IS NULL OR m.bucket >= w.next_bucket)
+    GROUP BY m.node, date_trunc('hour', m.bucket)
+    ON CONFLICT (node, bucket) DO UPDATE SET
+        samples = EXCLUDED.samples,
+        cpu_samples = EXCLUDED.cpu_samples,
+        gpu_samples = EXCLUDED.gpu_samples,
+        memory_samples = EXCLUDED.memory_samples,
+        cpu_avg = EXCLUDED.cpu_avg,
+        cpu_max = EXCLUDED.cpu_max,
+        gpu_avg = EXCLUDED.gpu_avg,
+        gpu_max = EXCLUDED.gpu_max,
+        memory_avg = EXCLUDED.memory_avg,
+        memory_max = EXCLUDED.memory_max,
+        storage_max = EXCLUDED.storage_max,
+        api_calls_max = EXCLUDED.api_calls_max,
+        queue_size_max = EXCLUDED.queue_size_max,
+        active_sessions_max = EXCLUDED.active_sessions_max;
+
+    DROP TABLE resource_usage_minute_marks;
+    DROP TABLE resource_usage_hour_marks;
+
+    DELETE FROM resource_usage_raw
+        WHERE timestamp < LEAST(v_minute_window, NOW() - p_raw_retention);
+    DELETE FROM resource_usage_1m
+        WHERE bucket < LEAST(v_hour_window, NOW() - p_minute_retention);
+    DELETE FROM resource_usage_1h
+        WHERE bucket < NOW() - p_hour_retention;
+END;
+$$ language 'plpgsql';
+
+-- RLS
+ALTER TABLE resource_usage_raw ENABLE ROW LEVEL SECURITY;
+ALTER TABLE resource_usage_1m ENABLE ROW LEVEL SECURITY;
+ALTER TABLE resource_usage_1h ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Raw resource usage is readable by authenticated users"
+    ON resource_usage_raw FOR SELECT
+    USING (auth.role() = 'authenticated');
+
+CREATE POLICY "Minute resource usage is readable by authenticated users"
+    ON resource_usage_1m FOR SELECT
+    USING (auth.role() = 'authenticated');
+
+CREATE POLICY "Hourly resource usage is readable by authenticated users"
+    ON resource_usage_1h FOR SELECT
+    USING (auth.role() = 'authenticated');
+
+-- Ежеминутное прореживание, если доступен pg_cron
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule(
+            'resource-usage-downsample',
+            '* * * * *',
+            'SELECT downsample_resource_usage();'
+        );
+    END IF;
+END;
+$$;